@@ -1,6 +1,21 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth.models import Permission
+from django.db.models import OuterRef, Subquery
 from .models import User, PickupPoint, WarehouseCN, ClientCodeCounter, Order, TrackingEvent, AutoStatusTemplate
 
+class UserChangeList(ChangeList):
+    """Список пользователей: только колонки из list_display (без хеша пароля и прочего)."""
+    list_fields = (
+        "id", "full_name", "phone", "is_employee", "is_active",
+        "pickup_point", "pickup_point__name_ru",
+    )
+
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        return qs.only(*self.list_fields)
+
+
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display  = ("full_name", "phone", "is_employee", "pickup_point", "is_active")
@@ -14,12 +29,22 @@ class UserAdmin(admin.ModelAdmin):
         ("Служебное", {"fields": ("last_login", "date_joined", "updated_at")}),
     )
     readonly_fields = ("date_joined", "updated_at")
+    # без автокомплита форма грузит все ПВЗ/группы/права в <select>
+    autocomplete_fields = ("pickup_point", "groups", "user_permissions")
+
+    def get_queryset(self, request):
+        # колонка «ПВЗ» в списке — без отдельного запроса на каждую строку
+        return super().get_queryset(request).select_related("pickup_point")
+
+    def get_changelist(self, request, **kwargs):
+        return UserChangeList
 
 @admin.register(PickupPoint)
 class PickupPointAdmin(admin.ModelAdmin):
     list_display = ("name_ru", "code_pair", "lc_prefix", "is_active")
     list_filter  = ("is_active",)
     search_fields= ("name_ru", "region_code", "branch_code")
+    ordering     = ("name_ru",)  # стабильная пагинация в автокомплите
 
 @admin.register(WarehouseCN)
 class WarehouseCNAdmin(admin.ModelAdmin):
@@ -31,6 +56,7 @@ class WarehouseCNAdmin(admin.ModelAdmin):
 class ClientCodeCounterAdmin(admin.ModelAdmin):
     list_display = ("pickup_point", "last_number", "updated_at")
     search_fields= ("pickup_point__name_ru",)
+    list_select_related = ("pickup_point",)
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
@@ -38,8 +64,21 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ("tracking_number", "user__full_name", "user__phone")
     autocomplete_fields = ("user",)
 
+    def get_queryset(self, request):
+        # последний статус считаем подзапросом в том же SELECT, а не запросом на строку
+        last = (
+            TrackingEvent.objects.filter(order=OuterRef("pk"))
+            .order_by("-timestamp")
+            .values("status")[:1]
+        )
+        return (
+            super().get_queryset(request)
+            .select_related("user")
+            .annotate(_last_status=Subquery(last))
+        )
+
     def last_status_admin(self, obj):
-        return obj.last_status
+        return obj._last_status
     last_status_admin.short_description = "Последний статус"
 
 @admin.register(TrackingEvent)
@@ -47,6 +86,24 @@ class TrackingEventAdmin(admin.ModelAdmin):
     list_display  = ("order", "status", "location", "timestamp", "actor")
     list_filter   = ("status", "timestamp")
     search_fields = ("order__tracking_number", "status", "actor__full_name")
+    autocomplete_fields = ("order", "actor")
+    ordering      = ("timestamp",)
+    # str(order) показывает клиента — подтягиваем и его
+    list_select_related = ("order__user", "actor")
+
+    # ручная правка событий сбивает current_step/last_manual_scan_at у заказа
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        Order.forget_scan_state([obj.order_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Order.forget_scan_state([obj.order_id])
+
+    def delete_queryset(self, request, queryset):
+        order_ids = list(queryset.values_list("order_id", flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        Order.forget_scan_state(order_ids)
 
 @admin.register(AutoStatusTemplate)
 class AutoStatusTemplateAdmin(admin.ModelAdmin):
@@ -54,3 +111,21 @@ class AutoStatusTemplateAdmin(admin.ModelAdmin):
     list_filter   = ("phase", "is_active")
     search_fields = ("text",)
     ordering      = ("phase", "order_index")
+
+@admin.register(Permission)
+class PermissionAdmin(admin.ModelAdmin):
+    """Только для автокомплита прав в UserAdmin: просмотр без редактирования."""
+    search_fields = ("name", "codename", "content_type__app_label")
+
+    def get_queryset(self, request):
+        # str(permission) включает content_type
+        return super().get_queryset(request).select_related("content_type")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
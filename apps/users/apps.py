@@ -7,4 +7,5 @@ class UsersConfig(AppConfig):
     
     def ready(self):
         import apps.users.signals
+        import apps.users.checks  # noqa: F401
  
\ No newline at end of file
@@ -0,0 +1,38 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class ScannerJWTAuthentication(JWTAuthentication):
+    """
+    JWT для эндпоинтов сканера: пользователя грузим только теми полями,
+    что нужны для IsEmployee и текста скана (ФИО сотрудника, его ПВЗ).
+    Права по-прежнему читаем из БД, а не из токена — снятый флаг сотрудника действует сразу.
+    """
+    user_fields = ("id", "full_name", "pickup_point_id", "is_active", "is_employee", "is_staff", "is_superuser")
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        fields = self.user_fields
+        if api_settings.CHECK_REVOKE_TOKEN:
+            fields += ("password",)
+
+        try:
+            user = self.user_model.objects.only(*fields).get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,34 @@
+from django.core import checks
+from django.db import DatabaseError
+from django.db.models import Count
+
+
+@checks.register(checks.Tags.database)
+def check_duplicate_client_codes(app_configs, databases=None, **kwargs):
+    """
+    client_code уникален на уровне БД: если в живой базе уже есть повторы,
+    уникальный индекс не создастся — сообщаем об этом до деплоя (manage.py check --database default).
+    """
+    from .models import User
+
+    errors = []
+    for alias in databases or ():
+        try:
+            dups = list(
+                User.objects.using(alias)
+                .filter(client_code__isnull=False)
+                .values("client_code")
+                .annotate(n=Count("id"))
+                .filter(n__gt=1)
+                .values_list("client_code", flat=True)[:10]
+            )
+        except DatabaseError:
+            continue  # таблицы ещё нет — проверять нечего
+        if dups:
+            errors.append(checks.Error(
+                f"В БД '{alias}' есть повторяющиеся client_code: {', '.join(dups)}",
+                hint="Разведите коды (новый lc_number и assign_client_code()) до создания уникального индекса.",
+                obj=User,
+                id="users.E001",
+            ))
+    return errors
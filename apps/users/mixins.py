@@ -0,0 +1,59 @@
+# apps/users/mixins.py
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def _collect_paths(serializer, model, prefix, select, prefetch, in_prefetch):
+    for field in serializer.fields.values():
+        if field.write_only or field.source == "*":
+            continue
+
+        path, rel_model, many = prefix, model, in_prefetch
+        for attr in field.source_attrs:
+            try:
+                model_field = rel_model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                break  # property / метод модели — дальше не видно
+            if not model_field.is_relation or model_field.related_model is None:
+                break
+            path = f"{path}__{attr}" if path else attr
+            rel_model = model_field.related_model
+            many = many or model_field.many_to_many or model_field.one_to_many
+            (prefetch if many else select).add(path)
+        else:
+            if path == prefix:
+                continue  # не связь
+            child = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(child, serializers.Serializer):
+                _collect_paths(child, rel_model, path, select, prefetch, many)
+
+
+@lru_cache(maxsize=None)
+def _eager_spec(serializer_class):
+    """(select_related, prefetch_related) по вложенным сериалайзерам; считаем один раз на класс."""
+    model = serializer_class.Meta.model
+    select, prefetch = set(), set()
+    _collect_paths(serializer_class(), model, "", select, prefetch, False)
+    # select_related внутри prefetch-пути Django не примет — такие пути уходят в prefetch
+    return tuple(sorted(select)), tuple(sorted(prefetch))
+
+
+class AutoPrefetchMixin:
+    """
+    Сам подбирает select_related / prefetch_related по полям сериалайзера:
+    FK и OneToOne — JOIN, обратные связи и M2M — prefetch.
+    Свойства модели (client_code_display и т.п.) не видны — их связи указывайте вручную.
+    """
+
+    def eager_load(self, queryset):
+        select, prefetch = _eager_spec(self.get_serializer_class())
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def get_queryset(self):
+        return self.eager_load(super().get_queryset())
@@ -1,7 +1,12 @@
-from django.db import models, transaction, IntegrityError
+import time
+
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Case, IntegerField, Max, Q, Value, When, prefetch_related_objects
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
-from django.core.validators import RegexValidator
+from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.conf import settings
 from datetime import timedelta
 
@@ -21,6 +26,9 @@ class Order(models.Model):
         "Прибыл в пункт выдачи",
         "Получен",
     ]
+    # текст шага → индекс; шаг 3 пишется в развернутом виде и узнаётся по префиксу
+    _FLOW_STEP3 = STATUS_FLOW.index("Прибыл в пункт выдачи")
+    _FLOW_INDEX = {text: idx for idx, text in enumerate(STATUS_FLOW) if text != "Прибыл в пункт выдачи"}
 
     id = models.BigAutoField(primary_key=True)
     user = models.ForeignKey(
@@ -40,20 +48,52 @@ class Order(models.Model):
     description = models.CharField("Описание (опционально)", max_length=255, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
 
+    # Денормализованное состояние сканов (обновляет apply_scan).
+    # NULL — состояние не известно (старые заказы, правка событий в админке): считаем по событиям.
+    current_step = models.PositiveSmallIntegerField("Пройдено шагов", null=True, blank=True, editable=False)
+    last_manual_scan_at = models.DateTimeField("Последний ручной скан", null=True, blank=True, editable=False)
+
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ["-created_at"]
+        indexes = [
+            # «мои заказы»: filter(user=...).order_by("-created_at")
+            models.Index(fields=["user", "-created_at"], name="order_user_ctime_desc"),
+        ]
 
     def __str__(self):
         return f"{self.tracking_number} ({getattr(self.user, 'full_name', 'без клиента')})"
 
     # ---------- Вспомогательные ----------
-    @property
+    # значения, закэшированные на экземпляре (cached_property) и зависящие от событий
+    _EVENTS_DERIVED = ("_events_cache", "last_event", "last_status", "manual_scan_count", "next_status")
+
+    @cached_property
+    def _events_cache(self):
+        """
+        Все события заказа одним запросом, от новых к старым.
+        Из этого списка считаются last_event / last_manual_event / manual_scan_count / next_status,
+        поэтому скан стоит один SELECT по событиям, а не по одному на каждое свойство.
+        Если события уже пришли через prefetch_related("events") — берём их.
+        """
+        events = getattr(self, "_prefetched_objects_cache", {}).get("events")
+        if events is None:
+            events = self.events.only("status", "timestamp", "actor_id")
+        return sorted(events, key=lambda e: e.timestamp, reverse=True)
+
+    def _reset_events_cache(self):
+        """Сбросить закэшированные статусы после добавления событий."""
+        for name in self._EVENTS_DERIVED:
+            self.__dict__.pop(name, None)
+        getattr(self, "_prefetched_objects_cache", {}).pop("events", None)
+
+    @cached_property
     def last_event(self):
-        return self.events.order_by("-timestamp").first()
+        events = self._events_cache
+        return events[0] if events else None
 
-    @property
+    @cached_property
     def last_status(self):
         ev = self.last_event
         return ev.status if ev else None
@@ -62,35 +102,78 @@ class Order(models.Model):
     @property
     def last_manual_event(self):
         """Последний РУЧНОЙ скан (actor не NULL)."""
-        return self.events.filter(actor__isnull=False).order_by("-timestamp").first()
+        return next((e for e in self._events_cache if e.actor_id), None)
 
-    @property
+    @cached_property
     def manual_scan_count(self) -> int:
         """Сколько ручных сканов уже сделано (для вычисления шага 1..4)."""
-        return self.events.filter(actor__isnull=False).count()
+        return sum(1 for e in self._events_cache if e.actor_id)
 
     @property
+    def _events_loaded(self) -> bool:
+        """События уже в памяти (свой кэш или prefetch_related("events"))."""
+        return "_events_cache" in self.__dict__ or "events" in getattr(self, "_prefetched_objects_cache", {})
+
+    @classmethod
+    def _flow_index(cls, status: str) -> int:
+        """Номер шага STATUS_FLOW по тексту события (-1 — не шаг)."""
+        # шаг 3 логирован в развернутом виде — сравнение по префиксу
+        if status.startswith("Товар прибыл в пункт выдачи"):
+            return cls._FLOW_STEP3
+        return cls._FLOW_INDEX.get(status, -1)
+
+    @classmethod
+    def _flow_step_q(cls, flow_text: str) -> Q:
+        # шаг 3 логирован в развернутом виде — сравнение по префиксу
+        if flow_text == "Прибыл в пункт выдачи":
+            return Q(status__startswith="Товар прибыл в пункт выдачи")
+        return Q(status=flow_text)
+
+    def _flow_steps_done(self) -> list:
+        """
+        Для каждого шага STATUS_FLOW — есть ли по нему событие.
+        Один SELECT с MAX(CASE ...) по шагам вместо выгрузки всех статусов в Python.
+        """
+        marks = self.events.aggregate(**{
+            f"s{idx}": Max(Case(
+                When(self._flow_step_q(flow_text), then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            ))
+            for idx, flow_text in enumerate(self.STATUS_FLOW)
+        })
+        return [bool(marks[f"s{idx}"]) for idx in range(len(self.STATUS_FLOW))]
+
+    @cached_property
     def next_status(self):
         """
         СТРОГИЙ порядок 1→2→3→4.
-        Прогресс считаем по наличию РУЧНЫХ статусов из STATUS_FLOW подряд с начала.
+        Прогресс считаем по наличию статусов из STATUS_FLOW подряд с начала.
         Шаг 3 у нас форматируется, поэтому сверяем startswith.
-        Автостатусы (actor IS NULL) игнорируем.
+        Автора события не смотрим — как и current_step: скан без сотрудника (user=None)
+        тоже двигает шаг, а после удаления сотрудника (SET_NULL) его сканы остаются пройденными.
+        Тексты автостатусов с шагами не совпадают, так что они в прогресс не попадают.
+        Если известен current_step — берём его; если события уже в памяти — считаем по ним,
+        иначе одним агрегирующим запросом.
         """
-        manual_texts = list(
-            self.events.filter(actor__isnull=False).values_list("status", flat=True)
-        )
-
-        def matches(flow_text: str, actual: str) -> bool:
-            # шаг 3 логирован в развернутом виде — сравнение по префиксу
-            if flow_text == "Прибыл в пункт выдачи":
-                return actual.startswith("Товар прибыл в пункт выдачи")
-            return actual == flow_text
+        if self.current_step is not None:
+            if self.current_step < len(self.STATUS_FLOW):
+                return self.STATUS_FLOW[self.current_step]
+            return None
+
+        if self._events_loaded:
+            done = [False] * len(self.STATUS_FLOW)
+            for e in self._events_cache:
+                idx = self._flow_index(e.status)
+                if idx >= 0:
+                    done[idx] = True
+        else:
+            done = self._flow_steps_done()
 
         # последовательно проверяем шаги с начала
         progress = -1
-        for idx, flow_text in enumerate(self.STATUS_FLOW):
-            if any(matches(flow_text, t) for t in manual_texts):
+        for idx, step_done in enumerate(done):
+            if step_done:
                 progress = idx
             else:
                 break
@@ -103,10 +186,33 @@ class Order(models.Model):
     def can_scan(self) -> bool:
         """Кулдаун считаем по последнему РУЧНОМУ скану."""
         cooldown_min = getattr(settings, "SCAN_COOLDOWN_MINUTES", 5)
-        last = self.last_manual_event
-        if not last:
+        if self.current_step is not None:
+            last_ts = self.last_manual_scan_at
+        else:
+            last = self.last_manual_event
+            last_ts = last.timestamp if last else None
+        if not last_ts:
             return True
-        return timezone.now() - last.timestamp >= timedelta(minutes=cooldown_min)
+        return timezone.now() - last_ts >= timedelta(minutes=cooldown_min)
+
+    @classmethod
+    def forget_scan_state(cls, pks):
+        """События правили в обход apply_scan — пусть шаг и кулдаун снова считаются по событиям."""
+        cls.objects.filter(pk__in=pks).update(current_step=None, last_manual_scan_at=None)
+
+    def _resync_scan_state(self):
+        """current_step разошёлся с событиями: сбросить его и считать шаг и кулдаун по событиям."""
+        self.forget_scan_state([self.pk])
+        self.current_step = None
+        self.last_manual_scan_at = None
+        self._reset_events_cache()
+
+    def _mark_scanned(self, nxt: str, ev: "TrackingEvent"):
+        """Запомнить на заказе пройденный шаг и время ручного скана (без UPDATE)."""
+        self.current_step = self.STATUS_FLOW.index(nxt) + 1
+        # кулдаун, как и last_manual_event, считается только по сканам сотрудника
+        if ev.actor_id:
+            self.last_manual_scan_at = ev.timestamp
 
     # ---------- Подстановки для статусов ----------
     def _template_context(self, actor=None):
@@ -135,18 +241,21 @@ class Order(models.Model):
             "dest_code": dest_code,
         }
 
-    def _render_text(self, template_text: str, actor=None) -> str:
-        """Безопасная подстановка плейсхолдеров {pvz_name}, {pvz_code}, {track}, {pvz_address}, {dest_city} ..."""
+    @staticmethod
+    def _render_text(template_text: str, ctx: dict) -> str:
+        """
+        Безопасная подстановка плейсхолдеров {pvz_name}, {pvz_code}, {track}, {pvz_address}, {dest_city} ...
+        ctx — результат _template_context(), считается один раз на скан.
+        """
         try:
-            return template_text.format(**self._template_context(actor=actor))
+            return template_text.format_map(ctx)
         except Exception:
+            # шаблоны правят в админке — опечатка в плейсхолдере не должна ронять скан
             return template_text
 
-    def apply_scan(self, location: str = "", actor=None):
-        """
-        Добавить следующий статус по скану. Возвращает созданный TrackingEvent или None, если уже всё пройдено.
-        Если actor передан — требуем, чтобы он был сотрудником/админом.
-        """
+    @staticmethod
+    def _check_scan_actor(actor):
+        """Сканировать могут только сотрудники/админы (actor=None — старый код без пользователя)."""
         if actor is not None:
             if not (
                 getattr(actor, "is_employee", False)
@@ -155,6 +264,23 @@ class Order(models.Model):
             ):
                 raise PermissionError("Сканировать могут только сотрудники.")
 
+    def _scan_status_text(self, nxt: str, ctx: dict) -> str:
+        """Текст события для шага: для шага 3 — как на макете."""
+        if nxt == "Прибыл в пункт выдачи":
+            return self._render_text(
+                "Товар прибыл в пункт выдачи "
+                "[{pvz_name} {pvz_code}, трек-номер: {track}, адрес: {pvz_address}]",
+                ctx,
+            )
+        return nxt
+
+    def apply_scan(self, location: str = "", actor=None):
+        """
+        Добавить следующий статус по скану. Возвращает созданный TrackingEvent или None, если уже всё пройдено.
+        Если actor передан — требуем, чтобы он был сотрудником/админом.
+        """
+        self._check_scan_actor(actor)
+
         # Проверка кулдауна по РУЧНОМУ событию
         if not self.can_scan():
             cooldown_min = getattr(settings, "SCAN_COOLDOWN_MINUTES", 5)
@@ -165,27 +291,92 @@ class Order(models.Model):
         if not nxt:
             return None  # уже «Получен»
 
-        # Формируем текст: для шага 3 — как на макете
-        status_text = nxt
-        if nxt == "Прибыл в пункт выдачи":
-            status_text = self._render_text(
-                "Товар прибыл в пункт выдачи "
-                "[{pvz_name} {pvz_code}, трек-номер: {track}, адрес: {pvz_address}]",
-                actor=actor,
-            )
-
-        ev = TrackingEvent.objects.create(
-            order=self,
-            status=status_text,
-            location=location or "",
-            actor=actor,  # фиксируем, кто сканировал (если передан)
-        )
+        ctx = self._template_context(actor=actor)  # один раз на скан: и для шага 3, и для автостатусов
+        for resynced in (False, True):
+            try:
+                with transaction.atomic():
+                    ev = TrackingEvent.objects.create(
+                        order=self,
+                        status=self._scan_status_text(nxt, ctx),
+                        location=location or "",
+                        actor=actor,  # фиксируем, кто сканировал (если передан)
+                    )
+                break
+            except IntegrityError:
+                # такой статус у заказа уже есть (trkev_order_status_uniq)
+                if resynced:
+                    return None  # шаг уже пройден — второго такого события не добавляем
+                # current_step отстал от событий — пересчитываем шаг по ним
+                self._resync_scan_state()
+                if not self.can_scan():
+                    cooldown_min = getattr(settings, "SCAN_COOLDOWN_MINUTES", 5)
+                    raise ValueError(f"Скан возможен только через {cooldown_min} минут")
+                nxt = self.next_status
+                if not nxt:
+                    return None
+        self._mark_scanned(nxt, ev)
+        self.save(update_fields=["current_step", "last_manual_scan_at"])
 
         # «Досыпать» автостатусы, если их время уже пришло
-        self.create_due_auto_events(base_event=ev, actor=actor)
+        self.create_due_auto_events(base_event=ev, actor=actor, ctx=ctx)
+        self._reset_events_cache()
 
         return ev
 
+    @classmethod
+    def apply_scan_bulk(cls, orders, location: str = "", actor=None):
+        """
+        Пакетный скан: следующий статус для каждого заказа одним INSERT.
+        Заказы без следующего шага или на кулдауне пропускаются (без исключения).
+        Шаг и кулдаун берутся из current_step/last_manual_scan_at; для старых заказов
+        (current_step IS NULL) проверки пойдут по памяти, если передать их с prefetch_related("events").
+        Возвращает список созданных TrackingEvent.
+        """
+        cls._check_scan_actor(actor)
+
+        now = timezone.now()
+        pending = []
+        for order in orders:
+            nxt = order.next_status
+            if nxt and order.can_scan():
+                ctx = order._template_context(actor=actor)
+                ev = TrackingEvent(
+                    order=order,
+                    status=order._scan_status_text(nxt, ctx),
+                    location=location or "",
+                    actor=actor,
+                    timestamp=now,
+                )
+                pending.append((order, nxt, ev, ctx))
+
+        try:
+            with transaction.atomic():
+                events = TrackingEvent.objects.bulk_create([ev for _, _, ev, _ in pending], batch_size=1000)
+        except IntegrityError:
+            # у кого-то из заказов шаг разошёлся с событиями — сканируем их по одному,
+            # apply_scan сам пересчитает шаг; один такой трек не роняет весь пакет
+            events = []
+            for order, *_ in pending:
+                try:
+                    ev = order.apply_scan(location=location, actor=actor)
+                except ValueError:
+                    continue  # после пересчёта оказался на кулдауне
+                if ev:
+                    events.append(ev)
+            return events
+
+        for order, nxt, ev, _ in pending:
+            order._mark_scanned(nxt, ev)
+        cls.objects.bulk_update(
+            [order for order, *_ in pending], ["current_step", "last_manual_scan_at"], batch_size=1000
+        )
+
+        for order, _, ev, ctx in pending:
+            order.create_due_auto_events(base_event=ev, actor=actor, ctx=ctx)
+            order._reset_events_cache()
+
+        return events
+
     # ---------- Автоматические статусы по времени ----------
     PHASE_BY_STATUS = {
         "Товар поступил на склад в Китае": "AFTER_SCAN_1",
@@ -194,10 +385,11 @@ class Order(models.Model):
         "Получен": "AFTER_SCAN_4",
     }
 
-    def create_due_auto_events(self, base_event: "TrackingEvent", actor=None):
+    def create_due_auto_events(self, base_event: "TrackingEvent", actor=None, ctx: dict | None = None):
         """
         «Ленивая» автодозагрузка: создаёт только те авто-события из шаблонов,
         у которых (base_event.timestamp + offset) <= now и которых ещё нет у заказа.
+        ctx — готовый контекст подстановок (из apply_scan); если не передан, считаем здесь.
         """
         phase = self.PHASE_BY_STATUS.get(base_event.status)
         # если статус шага 3 был отформатирован, он начинается с "Товар прибыл в пункт выдачи"
@@ -206,27 +398,44 @@ class Order(models.Model):
         if not phase:
             return
 
-        templates = AutoStatusTemplate.objects.filter(phase=phase, is_active=True).order_by("order_index")
+        templates = AutoStatusTemplate.objects.for_phase(phase)
 
         now = timezone.now()
-        exists_cache = set(self.events.values_list("status", flat=True))  # чтобы меньше бить БД
 
-        for tpl in templates:
-            due_ts = base_event.timestamp + timedelta(minutes=tpl.offset_minutes)
+        to_create = []
+        for text, offset_minutes in templates:
+            due_ts = base_event.timestamp + timedelta(minutes=offset_minutes)
             if due_ts <= now:
-                rendered = self._render_text(tpl.text, actor=actor)
-                if rendered not in exists_cache:
-                    TrackingEvent.objects.create(
-                        order=self,
-                        status=rendered,
-                        location="(авто)",
-                        timestamp=due_ts,  # важно: историческая отметка
-                    )
-                    exists_cache.add(rendered)
+                if ctx is None:
+                    ctx = self._template_context(actor=actor)
+                to_create.append(TrackingEvent(
+                    order=self,
+                    status=self._render_text(text, ctx),
+                    location="(авто)",
+                    timestamp=due_ts,  # важно: историческая отметка
+                ))
+
+        # все «созревшие» автостатусы — одним INSERT;
+        # уже существующие у заказа отсекает уникальность (order, status)
+        if to_create:
+            TrackingEvent.objects.bulk_create(to_create, ignore_conflicts=True)
 
 # =========================
 #     Событие трекинга
 # =========================
+class TrackingEventQuerySet(models.QuerySet):
+    def for_history(self):
+        """
+        События для выдачи истории (TrackingEventSerializer): по времени,
+        ФИО сотрудника тем же JOIN (иначе запрос на каждое событие), только нужные колонки.
+        """
+        return (
+            self.select_related("actor")
+            .only("id", "order_id", "status", "location", "timestamp", "actor_id", "actor__full_name")
+            .order_by("timestamp")
+        )
+
+
 class TrackingEvent(models.Model):
     """История сканирований/статусов по заказу."""
 
@@ -251,10 +460,25 @@ class TrackingEvent(models.Model):
         verbose_name="Сотрудник",
     )
 
+    objects = TrackingEventQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Событие отслеживания"
         verbose_name_plural = "События отслеживания"
-        ordering = ["timestamp"]
+        # без ordering по умолчанию: сортируем явно там, где порядок нужен
+        constraints = [
+            # один и тот же статус у заказа не повторяется (автостатусы досыпаются идемпотентно)
+            models.UniqueConstraint(fields=["order", "status"], name="trkev_order_status_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["order", "-timestamp"], name="trkev_order_ts_desc"),
+            # только ручные сканы: последний ручной скан (кулдаун)
+            models.Index(
+                fields=["order", "-timestamp"],
+                condition=Q(actor__isnull=False),
+                name="trkev_order_manual_ts_desc",
+            ),
+        ]
 
     def __str__(self):
         return f"[{self.timestamp:%Y-%m-%d %H:%M}] {self.status}"
@@ -281,8 +505,24 @@ class WarehouseCN(models.Model):
         return self.name or self.address_cn
 
 
-# двузначный код: "01", "02", ...
-DIG2 = RegexValidator(r"^\d{2}$", 'Требуется двузначный код, например "01".')
+# форматы фиксированные — проверяем длиной и isdecimal(), без regex
+def _is_kg_phone(value) -> bool:
+    """+996 и ровно 9 цифр."""
+    return isinstance(value, str) and len(value) == 13 and value.startswith("+996") and value[4:].isdecimal()
+
+
+def validate_kg_phone(value):
+    if not _is_kg_phone(value):
+        raise ValidationError("Формат: +996XXXXXXXXX", code="invalid")
+
+
+def validate_dig2(value):
+    # двузначный код: "01", "02", ...
+    if not (isinstance(value, str) and len(value) == 2 and value.isdecimal()):
+        raise ValidationError('Требуется двузначный код, например "01".', code="invalid")
+
+
+DIG2 = validate_dig2
 
 
 # =========================
@@ -335,15 +575,34 @@ class PickupPoint(models.Model):
     def __str__(self):
         return self.name_ru
 
-    @property
+    @cached_property
     def code_pair(self) -> str:
         return f"{self.region_code}-{self.branch_code}"
 
+    @cached_property
+    def _code_template(self) -> str:
+        """Шаблон клиентского кода ПВЗ: подставляются только {region} и {lc}."""
+        # поля ПВЗ правят в админке — фигурные скобки в них не должны читаться как поля format
+        label, branch, prefix = (
+            value.replace("{", "{{").replace("}", "}}")
+            for value in (self.code_label, self.branch_code, self.lc_prefix)
+        )
+        return f"{label}-{{region}}-{branch}({prefix}-{{lc}})"
+
+    def format_client_code(self, lc: str, region: str = "") -> str:
+        return self._code_template.format(region=region or self.region_code, lc=lc)
+
 
 # =========================
 #    Пользовательский менеджер
 # =========================
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    def with_scan_context(self):
+        """ПВЗ и склад CN одним JOIN: для client_code_display / cn_warehouse_address / текстов сканов."""
+        return self.select_related("pickup_point", "pickup_point__default_cn_warehouse")
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     use_in_migrations = True
 
     def _create_user(self, phone, password, **extra_fields):
@@ -352,17 +611,31 @@ class UserManager(BaseUserManager):
         if not password:
             raise ValueError("Пароль обязателен")
 
-        phone = phone.replace(" ", "")
+        if " " in phone:
+            phone = phone.replace(" ", "")
+        if not _is_kg_phone(phone):
+            raise ValueError("Формат: +996XXXXXXXXX")
         user = self.model(phone=phone, **extra_fields)
         user.set_password(password)
 
         # Сначала генерируем client_code (если его нет)
+        auto_code = not user.client_code and not user.lc_number
         if not user.client_code:
             user.assign_client_code(save=False)
 
         # Сохраняем один раз — уже с client_code
-        user.save(using=self._db)
-        return user
+        for attempt in range(self.model.CLIENT_CODE_ATTEMPTS):
+            try:
+                with transaction.atomic(using=self._db):
+                    user.save(using=self._db)
+                return user
+            except IntegrityError as exc:
+                # номер из счётчика занят вручную введённым LC — берём следующий
+                last_try = attempt == self.model.CLIENT_CODE_ATTEMPTS - 1
+                if last_try or not auto_code or "client_code" not in str(exc):
+                    raise
+                user.lc_number = ""
+                user.assign_client_code(save=False)
 
     def create_user(self, phone, password=None, **extra_fields):
         extra_fields.setdefault("is_staff", False)
@@ -371,6 +644,10 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault("is_employee", False)
         return self._create_user(phone, password, **extra_fields)
 
+    def get_by_natural_key(self, username):
+        # через него логинит ModelBackend: ответ логина и токен читают ПВЗ и склад — тянем их сразу
+        return self.with_scan_context().get(**{self.model.USERNAME_FIELD: username})
+
     def create_superuser(self, phone, password, **extra_fields):
         extra_fields.setdefault("is_staff", True)
         extra_fields.setdefault("is_superuser", True)
@@ -407,23 +684,43 @@ class ClientCodeCounter(models.Model):
     last_number = models.PositiveIntegerField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
 
-    class Meta:
-        indexes = [models.Index(fields=["pickup_point"])]
-
     def __str__(self):
         return f"{self.pickup_point.name_ru} — {self.last_number}"
 
+    @classmethod
+    def allocate(cls, pickup_point) -> int:
+        """
+        Следующий номер LC для ПВЗ одним UPDATE ... RETURNING (SQLite 3.35+, PostgreSQL).
+        Инкремент делает сама БД: без SELECT FOR UPDATE, а блокировка строки
+        держится только до конца этого UPDATE (или внешней транзакции).
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = (
+            f"UPDATE {table} SET last_number = last_number + 1, updated_at = %s "
+            f"WHERE pickup_point_id = %s RETURNING last_number"
+        )
+        for _ in range(2):
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [now, pickup_point.pk])
+                row = cursor.fetchone()
+            if row:
+                return row[0]
+            # ПВЗ заведён до сигнала create_code_counter — создаём счётчик и повторяем
+            cls.objects.get_or_create(pickup_point=pickup_point)
+        raise cls.DoesNotExist(f"Нет счётчика LC для ПВЗ {pickup_point.pk}")
+
 
 # =========================
 #         Пользователь
 # =========================
 class User(AbstractBaseUser, PermissionsMixin):
-    KYRGYZ_PHONE = RegexValidator(regex=r"^\+996\d{9}$", message="Формат: +996XXXXXXXXX")
+    KYRGYZ_PHONE = validate_kg_phone
 
     id = models.BigAutoField(primary_key=True)
     full_name = models.CharField("ФИО", max_length=150)
     phone = models.CharField("Телефон", max_length=13, unique=True, validators=[KYRGYZ_PHONE], db_index=True)
-    email = models.EmailField("Email для восстановления", null=True, blank=True, unique=True)
+    email = models.EmailField("Email для восстановления", null=True, blank=True)
 
     pickup_point = models.ForeignKey(
         PickupPoint, on_delete=models.PROTECT, related_name="users", verbose_name="ПВЗ"
@@ -439,6 +736,7 @@ class User(AbstractBaseUser, PermissionsMixin):
         max_length=64,
         null=True,
         blank=True,
+        unique=True,
     )
 
     region_code = models.CharField("Код региона (ручной ввод)", max_length=10, blank=True)
@@ -461,26 +759,30 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
-        indexes = [models.Index(fields=["pickup_point"])]
+        constraints = [
+            # email уникален без учёта регистра — проверку держит БД, а не SELECT перед INSERT
+            models.UniqueConstraint(Lower("email"), name="users_email_ci_uniq"),
+        ]
 
     def __str__(self):
         return f"{self.full_name} ({self.phone})"
 
     # -------- Представления --------
-    @property
+    @cached_property
     def client_code_display(self) -> str:
-        pp = self.pickup_point
-        return (
-            f"{pp.code_label}-"
-            f"{self.region_code or pp.region_code}-"
-            f"{pp.branch_code}"
-            f"({pp.lc_prefix}-{self.lc_number})"
-        )
+        return self.pickup_point.format_client_code(self.lc_number, self.region_code)
+
+    _CODE_DERIVED = ("client_code_display", "cn_warehouse_address")
+
+    def _reset_code_cache(self):
+        """Сбросить закэшированные представления после смены LC/ПВЗ."""
+        for name in self._CODE_DERIVED:
+            self.__dict__.pop(name, None)
 
     def get_cn_warehouse(self):
         return self.pickup_point.default_cn_warehouse
 
-    @property
+    @cached_property
     def cn_warehouse_address(self) -> str:
         wh = self.get_cn_warehouse()
         base = wh.address_cn if wh else ""
@@ -492,33 +794,33 @@ class User(AbstractBaseUser, PermissionsMixin):
         return " ".join(p for p in parts if p)
 
     # -------- Генерация client_code --------
+    # сколько номеров пробуем, если код уже занят вручную введённым LC
+    CLIENT_CODE_ATTEMPTS = 5
+
     def assign_client_code(self, save=True):
+        self._reset_code_cache()
         pp = self.pickup_point
-        base_code = f"{pp.code_label}-{self.region_code or pp.region_code}-{pp.branch_code}"
 
         if not self.lc_number:
-            counter, _ = ClientCodeCounter.objects.get_or_create(pickup_point=pp)
-
-            while True:
-                counter.last_number += 1
-                candidate_lc = str(counter.last_number).zfill(4)
-                candidate_code = f"{base_code}({pp.lc_prefix}-{candidate_lc})"
-
-                if not User.objects.filter(client_code=candidate_code).exists():
-                    self.lc_number = candidate_lc
-                    self.client_code = candidate_code
-
-                    try:
-                        with transaction.atomic():
-                            counter.save(update_fields=["last_number"])
-                            if save:
-                                self.save(update_fields=["client_code", "lc_number", "updated_at"])
-                        break
-                    except IntegrityError:
-                        # гонка — пробуем следующий номер
-                        continue
+            for attempt in range(self.CLIENT_CODE_ATTEMPTS):
+                # номер выдаёт БД атомарным инкрементом: параллельные регистрации
+                # в этот ПВЗ не получат один и тот же номер
+                self.lc_number = str(ClientCodeCounter.allocate(pp)).zfill(4)
+                self.client_code = pp.format_client_code(self.lc_number, self.region_code)
+                if not save:
+                    break
+
+                # уникальность client_code держит БД, отдельная проверка exists() не нужна
+                try:
+                    with transaction.atomic():
+                        self.save(update_fields=["client_code", "lc_number", "updated_at"])
+                    break
+                except IntegrityError:
+                    # код уже занят (например, LC введён вручную) — берём следующий номер
+                    if attempt == self.CLIENT_CODE_ATTEMPTS - 1:
+                        raise
         else:
-            self.client_code = f"{base_code}({pp.lc_prefix}-{self.lc_number})"
+            self.client_code = pp.format_client_code(self.lc_number, self.region_code)
             if save:
                 self.save(update_fields=["client_code", "lc_number", "updated_at"])
 
@@ -528,6 +830,33 @@ class User(AbstractBaseUser, PermissionsMixin):
 # =========================
 #   Авто-статусы (шаблоны)
 # =========================
+# Активные шаблоны по фазам: (загружено_в, {phase: ((text, offset_minutes), ...)}).
+# Кэш в памяти процесса: сигналы сбрасывают его при правке шаблона в этом процессе,
+# остальные воркеры перечитают через AUTO_STATUS_TEMPLATES_TTL секунд.
+_TEMPLATES: dict = {}
+
+
+class AutoStatusTemplateManager(models.Manager):
+    def for_phase(self, phase: str) -> tuple:
+        """Активные шаблоны фазы как кортеж (text, offset_minutes) в порядке order_index."""
+        ttl = getattr(settings, "AUTO_STATUS_TEMPLATES_TTL", 60)
+        cached = _TEMPLATES.get("by_phase")
+        if cached is None or time.monotonic() - cached[0] > ttl:
+            # все фазы одним запросом — шаблонов единицы, а сканы идут по всем фазам
+            by_phase = {}
+            rows = self.filter(is_active=True).order_by("phase", "order_index").values_list(
+                "phase", "text", "offset_minutes"
+            )
+            for row_phase, text, offset_minutes in rows:
+                by_phase.setdefault(row_phase, []).append((text, offset_minutes))
+            cached = (time.monotonic(), {k: tuple(v) for k, v in by_phase.items()})
+            _TEMPLATES["by_phase"] = cached
+        return cached[1].get(phase, ())
+
+    def clear_cache(self):
+        _TEMPLATES.clear()
+
+
 class AutoStatusTemplate(models.Model):
     """
     Шаблоны автособытий, которые должны возникать ПОСЛЕ какого-то ручного скана.
@@ -541,6 +870,8 @@ class AutoStatusTemplate(models.Model):
     offset_minutes = models.PositiveIntegerField("Смещение (минуты)", default=0)
     is_active = models.BooleanField(default=True)
 
+    objects = AutoStatusTemplateManager()
+
     class Meta:
         ordering = ["phase", "order_index"]
         indexes = [models.Index(fields=["phase", "is_active"])]
@@ -549,9 +880,20 @@ class AutoStatusTemplate(models.Model):
         return f"{self.phase} #{self.order_index}: +{self.offset_minutes}m — {self.text[:40]}..."
 
 
+
 # =========================
 #   Утилита для сканера (атомарно)
 # =========================
+def _check_scanner(user):
+    """Сканировать могут только авторизованные сотрудники/админы (user=None — старый код)."""
+    if user is not None:
+        if not (
+            getattr(user, "is_authenticated", False)
+            and (getattr(user, "is_employee", False) or getattr(user, "is_staff", False) or getattr(user, "is_superuser", False))
+        ):
+            raise PermissionError("Сканировать могут только авторизованные сотрудники.")
+
+
 def handle_scan(
     tracking_number: str,
     *,
@@ -570,27 +912,77 @@ def handle_scan(
     """
     tn = (tracking_number or "").strip()
 
-    if user is not None:
-        if not (
-            getattr(user, "is_authenticated", False)
-            and (getattr(user, "is_employee", False) or getattr(user, "is_staff", False) or getattr(user, "is_superuser", False))
-        ):
-            raise PermissionError("Сканировать могут только авторизованные сотрудники.")
+    _check_scanner(user)
 
     with transaction.atomic():
         try:
-            order = Order.objects.select_for_update().get(tracking_number=tn)
-            created = False
+            # шаг и кулдаун читаются из current_step/last_manual_scan_at — события не тянем;
+            # ПВЗ клиента нужен для текста шага 3 и автостатусов — тем же JOIN.
+            # of=("self",): блокируем только заказ (PostgreSQL не даёт FOR UPDATE по nullable-стороне LEFT JOIN)
+            order = (
+                Order.objects.select_for_update(of=("self",))
+                .select_related("user__pickup_point")
+                .get(tracking_number=tn)
+            )
         except Order.DoesNotExist:
             # ВАЖНО: не привязываем сотрудника как владельца заказа!
-            order = Order.objects.create(tracking_number=tn, description=description)
-            created = True
+            order = Order.objects.create(tracking_number=tn, description=description, current_step=0)
 
-        if not created and not order.can_scan():
+        # кулдаун проверяет сам apply_scan — по заблокированной строке заказа, без отдельного запроса
+        try:
+            event = order.apply_scan(location=location or "", actor=user)
+        except ValueError:
             if raise_on_cooldown:
                 cooldown_min = getattr(settings, "SCAN_COOLDOWN_MINUTES", 5)
                 raise ValueError(f"Повторный скан того же трека возможен через {cooldown_min} минут.")
             return order, None
+        return order, event
+
+
+def handle_scan_many(
+    tracking_numbers,
+    *,
+    location: str | None = None,
+    user=None,
+    description: str = "",
+):
+    """
+    Пакетный вариант handle_scan для «очереди» сканера: одна транзакция,
+    один SELECT ... FOR UPDATE по всем трекам, один INSERT новых заказов и один — событий.
+    Повторы трека в пакете сканируются один раз; заказы на кулдауне или уже «Получен»
+    пропускаются без исключения (событие None).
+    Возвращает список (order, event | None) в порядке треков.
+    """
+    _check_scanner(user)
+
+    codes = list(dict.fromkeys(tn.strip() for tn in tracking_numbers if tn and tn.strip()))
+    if not codes:
+        return []
+
+    with transaction.atomic():
+        locked = Order.objects.select_for_update(of=("self",)).select_related("user__pickup_point")
+        orders = {o.tracking_number: o for o in locked.filter(tracking_number__in=codes)}
+
+        missing = [tn for tn in codes if tn not in orders]
+        if missing:
+            # ВАЖНО: не привязываем сотрудника как владельца заказа!
+            # ignore_conflicts — трек мог появиться параллельно; перечитываем под блокировкой
+            Order.objects.bulk_create(
+                [Order(tracking_number=tn, description=description, current_step=0) for tn in missing],
+                ignore_conflicts=True,
+            )
+            orders.update(
+                (o.tracking_number, o)
+                for o in locked.filter(tracking_number__in=missing)
+            )
+
+        batch = [orders[tn] for tn in codes]
+        # старые заказы без current_step считают шаг по событиям — тянем их одним запросом
+        # (тем же набором, что и для выдачи истории: с сотрудником в JOIN)
+        prefetch_related_objects(
+            [o for o in batch if o.current_step is None],
+            models.Prefetch("events", queryset=TrackingEvent.objects.for_history()),
+        )
 
-        event = order.apply_scan(location=location or "", actor=user)
-        return order, event
\ No newline at end of file
+        events = {ev.order_id: ev for ev in Order.apply_scan_bulk(batch, location=location or "", actor=user)}
+        return [(order, events.get(order.pk)) for order in batch]
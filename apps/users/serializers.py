@@ -1,7 +1,6 @@
 # serializers.py
 from django.conf import settings
 from django.contrib.auth import password_validation
-from django.core.mail import send_mail
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -10,8 +9,22 @@ from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed, ValidationError, Throttled, PermissionDenied
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.functions import Lower
 
-from .models import PickupPoint, WarehouseCN, User, Order, TrackingEvent, handle_scan
+from .models import PickupPoint, WarehouseCN, User, Order, TrackingEvent, handle_scan, handle_scan_many
+from .utils import send_mail_async
+
+# настройки сброса пароля читаем один раз при импорте
+_PWD_RESET_URL = getattr(settings, "PASSWORD_RESET_FRONTEND_URL", "https://lc189.com.kg/v1/api/users/auth/password-reset/confirm/")
+_FROM_EMAIL = getattr(settings, "DEFAULT_FROM_EMAIL", None)
+_DEBUG = getattr(settings, "DEBUG", False)
+
+# проверка ссылки сброса: функции берём локальными именами модуля
+_TOKEN_GEN = default_token_generator
+_VALIDATE_PW = password_validation.validate_password
+_B64DEC = urlsafe_base64_decode
 
 
 # -------------------------
@@ -51,10 +64,8 @@ class RegisterSerializer(serializers.ModelSerializer):
     def validate_email(self, value):
         if not value:
             return value
-        value = value.strip().lower()
-        if User.objects.filter(email__iexact=value).exists():
-            raise serializers.ValidationError("Этот email уже используется.")
-        return value
+        # занятость email проверит уникальный индекс при INSERT (см. create)
+        return value.strip().lower()
 
     def validate(self, attrs):
         password = attrs.get("password")
@@ -68,10 +79,18 @@ class RegisterSerializer(serializers.ModelSerializer):
         if email:
             validated_data["email"] = email.strip().lower()
 
-        user = User.objects.create_user(password=password, **validated_data)
-        if not user.client_code:
-            user.assign_client_code(save=True)
-        return user
+        # client_code назначает create_user — до единственного INSERT.
+        # atomic: если email занят, откатится и выданный номер LC (без дыр в нумерации)
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(password=password, **validated_data)
+        except IntegrityError as exc:
+            if "users_email_ci_uniq" in str(exc):
+                raise serializers.ValidationError({"email": ["Этот email уже используется."]})
+            if "client_code" in str(exc):
+                # ручной LC дал код, который уже есть у другого клиента
+                raise serializers.ValidationError({"lc_number": ["Этот номер LC уже занят в выбранном ПВЗ."]})
+            raise
 
     def get_cn_warehouse_address(self, obj: User):
         return obj.cn_warehouse_address
@@ -133,15 +152,15 @@ class PasswordResetRequestSerializer(serializers.Serializer):
     def create(self, validated_data):
         email = validated_data["email"].strip().lower()
         try:
-            user = User.objects.get(email__iexact=email)
+            # LOWER(email) = %s — попадает в функциональный индекс users_email_ci_uniq (iexact даёт UPPER и seq scan)
+            user = User.objects.annotate(email_l=Lower("email")).get(email_l=email)
         except User.DoesNotExist:
             self.instance = {"detail": "Если этот email зарегистрирован, мы отправили ссылку для восстановления."}
             return self.instance
 
         uid = urlsafe_base64_encode(force_bytes(user.pk))
         token = default_token_generator.make_token(user)
-        base = getattr(settings, "PASSWORD_RESET_FRONTEND_URL", "https://lc189.com.kg/v1/api/users/auth/password-reset/confirm/")
-        reset_link = f"{base}?uid={uid}&token={token}"
+        reset_link = f"{_PWD_RESET_URL}?uid={uid}&token={token}"
 
         subject = "Сброс пароля LIDER CARGO"
         message = (
@@ -149,16 +168,16 @@ class PasswordResetRequestSerializer(serializers.Serializer):
             f"Для сброса пароля перейдите по ссылке:\n{reset_link}\n\n"
             f"Если вы не запрашивали сброс, просто игнорируйте это письмо."
         )
-        send_mail(
+        send_mail_async(
             subject,
             message,
-            getattr(settings, "DEFAULT_FROM_EMAIL", None),
+            _FROM_EMAIL,
             [email],
             fail_silently=True,
         )
 
         self.instance = {"detail": "Если этот email зарегистрирован, мы отправили ссылку для восстановления."}
-        if getattr(settings, "DEBUG", False):
+        if _DEBUG:
             self.instance.update({"uid": uid, "token": token, "reset_link": reset_link})
         return self.instance
 
@@ -173,15 +192,15 @@ class PasswordResetConfirmSerializer(serializers.Serializer):
 
     def validate(self, attrs):
         try:
-            uid = force_str(urlsafe_base64_decode(attrs["uid"]))
+            uid = force_str(_B64DEC(attrs["uid"]))
             self.user = User.objects.get(pk=uid)
         except Exception:
             raise serializers.ValidationError("Неверная ссылка для сброса.")
 
-        if not default_token_generator.check_token(self.user, attrs["token"]):
+        if not _TOKEN_GEN.check_token(self.user, attrs["token"]):
             raise serializers.ValidationError("Неверный или просроченный токен.")
 
-        password_validation.validate_password(attrs["new_password"], user=self.user)
+        _VALIDATE_PW(attrs["new_password"], user=self.user)
         return attrs
 
     def create(self, validated_data):
@@ -257,11 +276,8 @@ class ProfileSerializer(serializers.ModelSerializer):
     def validate_email(self, value):
         if value is None or value == "":
             return value
-        value = value.strip().lower()
-        qs = User.objects.filter(email__iexact=value).exclude(pk=self.instance.pk if self.instance else None)
-        if qs.exists():
-            raise serializers.ValidationError("Этот email уже используется.")
-        return value
+        # занятость email проверит уникальный индекс при UPDATE (см. update)
+        return value.strip().lower()
 
     def update(self, instance: User, validated_data):
         pickup_was = instance.pickup_point_id
@@ -271,13 +287,33 @@ class ProfileSerializer(serializers.ModelSerializer):
         email = validated_data.get("email", instance.email)
         instance.email = email.strip().lower() if email else None
         instance.pickup_point = pickup_new
-        instance.save(update_fields=["full_name", "email", "pickup_point", "updated_at"])
-
-        # Если ПВЗ изменился — переназначаем клиентский код
-        if pickup_new.id != pickup_was:
-            instance.assign_client_code(save=True)
-
-        return instance
+        update_fields = ["full_name", "email", "pickup_point", "updated_at"]
+
+        # Если ПВЗ изменился — новый номер LC из счётчика нового ПВЗ (тем же UPDATE):
+        # старый номер там, скорее всего, уже у другого клиента
+        pickup_changed = pickup_new.id != pickup_was
+        if pickup_changed:
+            instance.lc_number = ""
+            update_fields += ["client_code", "lc_number"]
+
+        for _ in range(User.CLIENT_CODE_ATTEMPTS):
+            if pickup_changed:
+                instance.assign_client_code(save=False)
+            try:
+                with transaction.atomic():
+                    instance.save(update_fields=update_fields)
+                return instance
+            except IntegrityError as exc:
+                if "users_email_ci_uniq" in str(exc):
+                    raise serializers.ValidationError({"email": ["Этот email уже используется."]})
+                if not pickup_changed or "client_code" not in str(exc):
+                    raise
+                # номер из счётчика занят вручную введённым LC — берём следующий
+                instance.lc_number = ""
+
+        raise serializers.ValidationError(
+            {"pickup_point_id": ["Не удалось выдать личный код в этом ПВЗ, попробуйте ещё раз."]}
+        )
 
 
 # -------------------------
@@ -320,6 +356,25 @@ class OrderSerializer(serializers.ModelSerializer):
         return obj.can_scan()
 
 
+class OrderCompactSerializer(serializers.ModelSerializer):
+    """Заказ без списка событий: последний статус берётся подзапросом в основном SELECT."""
+    last_status = serializers.CharField(read_only=True)
+    last_ts = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ("id", "tracking_number", "description", "created_at", "last_status", "last_ts")
+
+
+class OrderFindSerializer(OrderSerializer):
+    """Заказ + флаги для поиска по треку (is_owner / can_claim аннотирует queryset)."""
+    is_owner = serializers.BooleanField(read_only=True)
+    can_claim = serializers.BooleanField(read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ("is_owner", "can_claim")
+
+
 # -------------------------
 #  Сканер
 # -------------------------
@@ -358,10 +413,64 @@ class OrderScanSerializer(serializers.Serializer):
         return self.instance
 
     def to_representation(self, instance):
+        order = instance["order"]
+        prefetch_related_objects(
+            [order], Prefetch("events", queryset=TrackingEvent.objects.for_history())
+        )
         return {
-            "order": OrderSerializer(instance["order"]).data,
+            "order": OrderSerializer(order).data,
             "created_event": (
                 TrackingEventSerializer(instance["created_event"]).data
                 if instance["created_event"] else None
             ),
         }
+
+
+class OrderScanBatchSerializer(serializers.Serializer):
+    """Сериалайзер для POST /orders/scan/batch/ — пачка треков от сканера."""
+    MAX_BATCH = 200
+
+    tracking_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=Order.TRACK_NUMBER_MAX_LENGTH),
+        allow_empty=False,
+        max_length=MAX_BATCH,
+    )
+    location = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_tracking_numbers(self, value):
+        # нормализация трека, как в OrderScanAPIView
+        return [tn.strip().upper() for tn in value]
+
+    def create(self, validated_data):
+        user = None
+        request = self.context.get("request")
+        if request and getattr(request, "user", None) and request.user.is_authenticated:
+            user = request.user
+
+        try:
+            results = handle_scan_many(
+                validated_data["tracking_numbers"],
+                location=validated_data.get("location", ""),
+                user=user,
+            )
+        except PermissionError as e:
+            raise PermissionDenied(detail=str(e))
+
+        self.instance = results
+        return self.instance
+
+    def to_representation(self, instance):
+        orders = [order for order, _ in instance]
+        prefetch_related_objects(
+            orders, Prefetch("events", queryset=TrackingEvent.objects.for_history())
+        )
+        return {
+            "results": [
+                {
+                    "tracking_number": order.tracking_number,
+                    "order": OrderSerializer(order).data,
+                    "created_event": TrackingEventSerializer(event).data if event else None,
+                }
+                for order, event in instance
+            ],
+        }
@@ -9,12 +9,26 @@
 #         instance.assign_client_code()
 
 
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import User
+from .models import AutoStatusTemplate, ClientCodeCounter, PickupPoint, User
 
 @receiver(pre_save, sender=User)
 def assign_client_code_before_save(sender, instance, **kwargs):
     # только для новых юзеров (ещё нет client_code)
     if not instance.client_code:
         instance.assign_client_code(save=False)  # без повторного save()
+
+
+@receiver(post_save, sender=PickupPoint)
+def create_code_counter(sender, instance, created, **kwargs):
+    # счётчик LC заводим сразу с ПВЗ — при регистрации остаётся только заблокировать строку
+    if created:
+        ClientCodeCounter.objects.get_or_create(pickup_point=instance)
+
+
+@receiver(post_save, sender=AutoStatusTemplate)
+@receiver(post_delete, sender=AutoStatusTemplate)
+def reset_auto_templates_cache(sender, **kwargs):
+    # шаблоны поменялись — следующий скан перечитает их из БД
+    AutoStatusTemplate.objects.clear_cache()
@@ -24,8 +24,10 @@ urlpatterns = [
 
     # orders
     path("orders/", MyOrdersAPIView.as_view(), name="my-orders"),
+    path("orders/track/", OrderTrackBatchAPIView.as_view(), name="order-track-batch"),
     path("orders/track/<str:tracking_number>/", OrderTrackAPIView.as_view(), name="order-track"),
     path("orders/scan/", OrderScanAPIView.as_view(), name="order-scan"),
+    path("orders/scan/batch/", OrderScanBatchAPIView.as_view(), name="order-scan-batch"),
     path("orders/find/", OrderFindAPIView.as_view(), name="order-find"),     # NEW
     path("orders/claim/", OrderClaimAPIView.as_view(), name="order-claim"), 
 ]
@@ -1,10 +1,27 @@
 # apps/users/utils.py
 import random
 import string
+from concurrent.futures import ThreadPoolExecutor
 
-def generate_unique_code(model, field_name="client_code", length=8):
+from django.core.mail import send_mail
+
+# Письма отправляем в фоне: ответ API не ждёт SMTP.
+# Пул в памяти процесса — без брокера; не отправленное письмо при рестарте воркера теряется.
+_mail_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mail")
+
+
+def generate_unique_code(model, field_name="client_code", length=8, batch=16, attempts=5):
     chars = string.ascii_uppercase + string.digits
-    while True:
-        code = "".join(random.choices(chars, k=length))
-        if not model.objects.filter(**{field_name: code}).exists():
-            return code
+    # проверяем сразу пачку кандидатов одним запросом ... WHERE field IN (...)
+    for _ in range(attempts):
+        cands = {"".join(random.choices(chars, k=length)) for _ in range(batch)}
+        taken = set(model.objects.filter(**{f"{field_name}__in": cands}).values_list(field_name, flat=True))
+        free = cands - taken
+        if free:
+            return next(iter(free))
+    raise RuntimeError(f"Не удалось подобрать свободный {field_name}")
+
+
+def send_mail_async(subject, message, from_email, recipient_list, **kwargs):
+    """send_mail в фоновом потоке; возвращает Future."""
+    return _mail_executor.submit(send_mail, subject, message, from_email, recipient_list, **kwargs)
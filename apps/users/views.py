@@ -3,16 +3,23 @@ from rest_framework import generics, status, permissions
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.db.models import Prefetch
-from django.db import transaction
+from django.db.models import BooleanField, Case, Count, Max, OuterRef, Prefetch, Q, Subquery, Value, When
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+import hashlib
+import jwt
 from datetime import timedelta
-from django.shortcuts import render
+from functools import lru_cache
+from pathlib import Path
+from django.conf import settings
+from django.http import HttpResponse
 
-from .models import PickupPoint, WarehouseCN, Order, TrackingEvent
+from .models import PickupPoint, WarehouseCN, Order, TrackingEvent, User
 from .serializers import (
     RegisterSerializer,
     PickupPointSerializer,
@@ -22,18 +29,36 @@ from .serializers import (
     PasswordResetRequestSerializer,
     ProfileSerializer,
     OrderSerializer,
+    OrderCompactSerializer,
+    OrderFindSerializer,
     OrderScanSerializer,
+    OrderScanBatchSerializer,
 )
 
 # 👇 НОВОЕ: подключаем пермишен
 from .permissions import IsEmployee
+from .authentication import ScannerJWTAuthentication
+from .mixins import AutoPrefetchMixin
 
 
 # -------------------------
 #   Auth
 # -------------------------
-def index(request):
-    return render(request, 'index.html')
+# index.html сборки React: между деплоями не меняется — читаем с диска один раз на процесс
+SPA_INDEX_PATH = Path(settings.BASE_DIR) / "apps" / "frontend" / "build" / "index.html"
+
+
+@lru_cache(maxsize=1)
+def _spa_html():
+    """(содержимое, ETag) для index.html."""
+    html = SPA_INDEX_PATH.read_bytes()
+    return html, f'"{hashlib.md5(html).hexdigest()}"'
+
+
+@cache_control(public=True, max_age=60)
+@condition(etag_func=lambda request, *args, **kwargs: _spa_html()[1])
+def index(request, *args, **kwargs):
+    return HttpResponse(_spa_html()[0], content_type="text/html; charset=utf-8")
 
 
 class RegisterAPIView(generics.CreateAPIView):
@@ -76,11 +101,16 @@ class LogoutAPIView(APIView):
         refresh = request.data.get("refresh")
         if not refresh:
             return Response({"detail": "Требуется refresh токен."}, status=status.HTTP_400_BAD_REQUEST)
+        # подпись не проверяем: нужен только jti, а без настоящего refresh его не узнать —
+        # чужой токен по выдуманному jti в blacklist не попадёт
         try:
-            token = RefreshToken(refresh)
-            token.blacklist()
-        except Exception:
-            pass
+            jti = jwt.decode(refresh, options={"verify_signature": False})[jwt_settings.JTI_CLAIM]
+        except (jwt.PyJWTError, KeyError, TypeError):
+            return Response(status=status.HTTP_205_RESET_CONTENT)
+
+        token_id = OutstandingToken.objects.filter(jti=jti).values_list("id", flat=True).first()
+        if token_id is not None:
+            BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=token_id)], ignore_conflicts=True)
         return Response(status=status.HTTP_205_RESET_CONTENT)
 
 
@@ -93,33 +123,54 @@ class LogoutAllAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        tokens = OutstandingToken.objects.filter(user=request.user)
-        for t in tokens:
-            try:
-                BlacklistedToken.objects.get_or_create(token=t)
-            except Exception:
-                pass
+        token_ids = OutstandingToken.objects.filter(user=request.user).values_list("id", flat=True)
+        # один INSERT на все токены; уже занесённые в blacklist отсекает уникальность token_id
+        BlacklistedToken.objects.bulk_create(
+            [BlacklistedToken(token_id=token_id) for token_id in token_ids],
+            ignore_conflicts=True,
+        )
         return Response(status=status.HTTP_205_RESET_CONTENT)
 
 
 # -------------------------
 #   Profile
 # -------------------------
-class MeAPIView(generics.RetrieveUpdateAPIView):
+class MeAPIView(AutoPrefetchMixin, generics.RetrieveUpdateAPIView):
     """
     GET  /me/    -> профиль текущего пользователя
     PATCH /me/   -> частичное обновление (full_name, email, pickup_point_id)
     """
     serializer_class = ProfileSerializer
     permission_classes = [IsAuthenticated]
+    queryset = User.objects.all()
 
     def get_object(self):
-        return self.request.user
+        # ПВЗ и склад (вложенный PickupPointSerializer) подтянет AutoPrefetchMixin — одним запросом
+        return self.get_queryset().get(pk=self.request.user.pk)
 
 
 # -------------------------
 #   Справочники
 # -------------------------
+def _catalog_etag(*models_):
+    """
+    ETag справочника: max(updated_at) и число строк каждой модели (ловит и удаление).
+    Совпал If-None-Match — 304 без выборки и сериализации.
+    """
+    def etag_func(request, *args, **kwargs):
+        parts = []
+        for model in models_:
+            agg = model.objects.aggregate(ts=Max("updated_at"), n=Count("pk"))
+            parts.append(f"{model._meta.label}:{agg['ts']}:{agg['n']}")
+        return hashlib.md5("|".join(parts).encode()).hexdigest()
+    return etag_func
+
+
+# справочники меняются редко: клиент может минуту не спрашивать, дальше — условный запрос
+_catalog_cache = cache_control(public=True, max_age=60)
+
+
+@method_decorator([_catalog_cache, condition(etag_func=_catalog_etag(PickupPoint, WarehouseCN))], name="get")
 class PickupPointList(generics.ListAPIView):
     serializer_class = PickupPointSerializer
     permission_classes = [AllowAny]
@@ -136,6 +187,7 @@ class PickupPointDetail(generics.RetrieveAPIView):
         return PickupPoint.objects.filter(is_active=True).select_related("default_cn_warehouse")
 
 
+@method_decorator([_catalog_cache, condition(etag_func=_catalog_etag(WarehouseCN))], name="get")
 class WarehouseCNList(generics.ListAPIView):
     serializer_class = WarehouseCNSerializer
     permission_classes = [AllowAny]
@@ -155,22 +207,76 @@ class WarehouseCNDetail(generics.RetrieveAPIView):
 # -------------------------
 #   Orders
 # -------------------------
+def _orders_for_serializer(qs):
+    """
+    Только поля OrderSerializer + события по времени;
+    у событий — ФИО сотрудника тем же JOIN (иначе запрос на каждое событие).
+    """
+    return (
+        qs.only("id", "user_id", "tracking_number", "description", "created_at", "current_step", "last_manual_scan_at")
+        .prefetch_related(Prefetch("events", queryset=TrackingEvent.objects.for_history()))
+    )
+
+
 class MyOrdersAPIView(generics.ListAPIView):
-    """GET /orders/ — список заказов текущего пользователя"""
+    """
+    GET /orders/ — список заказов текущего пользователя
+    GET /orders/?compact=1 — без истории событий, только последний статус (одним запросом)
+    """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def _compact(self) -> bool:
+        return self.request.query_params.get("compact") in ("1", "true")
+
+    def get_serializer_class(self):
+        return OrderCompactSerializer if self._compact() else OrderSerializer
+
     def get_queryset(self):
-        return (
-            Order.objects.filter(user=self.request.user)
-            .prefetch_related(
-                Prefetch(
-                    "events",
-                    queryset=TrackingEvent.objects.order_by("timestamp"),
+        qs = Order.objects.filter(user=self.request.user)
+        if self._compact():
+            last = TrackingEvent.objects.filter(order_id=OuterRef("pk")).order_by("-timestamp")
+            return (
+                qs.only("id", "tracking_number", "description", "created_at")
+                .annotate(
+                    last_status=Subquery(last.values("status")[:1]),
+                    last_ts=Subquery(last.values("timestamp")[:1]),
                 )
+                .order_by("-created_at")
             )
-            .order_by("-created_at")
-        )
+        return _orders_for_serializer(qs).order_by("-created_at")
+
+
+class OrderTrackBatchAPIView(APIView):
+    """
+    GET /orders/track/?tn=AB1&tn=AB2  (или ?tn=AB1,AB2)
+    Отследить несколько треков разом: два запроса на весь список, а не по два на каждый трек.
+    """
+    permission_classes = [permissions.AllowAny]
+    MAX_TRACKS = 50
+
+    def get(self, request):
+        tns = [
+            tn.strip().upper()  # 👈 нормализация трека
+            for value in request.query_params.getlist("tn")
+            for tn in value.split(",")
+            if tn.strip()
+        ]
+        tns = list(dict.fromkeys(tns))
+        if not tns:
+            return Response({"detail": "Укажите параметр tn."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(tns) > self.MAX_TRACKS:
+            return Response(
+                {"detail": f"Не больше {self.MAX_TRACKS} треков за запрос."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        orders = {o.tracking_number: o for o in _orders_for_serializer(Order.objects.filter(tracking_number__in=tns))}
+        found = [orders[tn] for tn in tns if tn in orders]
+        return Response({
+            "results": OrderSerializer(found, many=True).data,
+            "not_found": [tn for tn in tns if tn not in orders],
+        })
 
 
 class OrderTrackAPIView(APIView):
@@ -180,12 +286,7 @@ class OrderTrackAPIView(APIView):
     def get(self, request, tracking_number: str):
         tracking_number = (tracking_number or "").strip().upper()  # 👈 нормализация трека
         order = get_object_or_404(
-            Order.objects.prefetch_related(
-                Prefetch(
-                    "events",
-                    queryset=TrackingEvent.objects.order_by("timestamp"),
-                )
-            ),
+            _orders_for_serializer(Order.objects.all()),
             tracking_number=tracking_number,
         )
         serializer = OrderSerializer(order)
@@ -196,6 +297,7 @@ class OrderScanAPIView(generics.CreateAPIView):
     serializer_class = OrderScanSerializer
     # 👇 только авторизованные + только сотрудники/админы
     permission_classes = [IsAuthenticated, IsEmployee]
+    authentication_classes = [ScannerJWTAuthentication]
 
     def create(self, request, *args, **kwargs):
         # опционально нормализуем трек ещё до сериалайзера
@@ -211,6 +313,25 @@ class OrderScanAPIView(generics.CreateAPIView):
         return Response(serializer.data, status=status_code)
 
 
+class OrderScanBatchAPIView(generics.CreateAPIView):
+    """
+    POST /orders/scan/batch/
+    body: {"tracking_numbers": ["AB1", "AB2", ...], "location": "..."}
+    Пачка сканов одной транзакцией; треки на кулдауне/«Получен» возвращаются с created_event = null.
+    """
+    serializer_class = OrderScanBatchSerializer
+    permission_classes = [IsAuthenticated, IsEmployee]
+    authentication_classes = [ScannerJWTAuthentication]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()  # [(order, created_event | None), ...]
+
+        status_code = status.HTTP_201_CREATED if any(ev for _, ev in results) else status.HTTP_200_OK
+        return Response(serializer.data, status=status_code)
+
+
 class OrderFindAPIView(APIView):
     """
     GET /orders/find/?tracking_number=AB123
@@ -227,21 +348,26 @@ class OrderFindAPIView(APIView):
 
         tn = tn.strip().upper()  # 👈 нормализация трека
 
+        # флаги считает сам SELECT — при выдаче списком не будет вычислений на каждую строку
+        # CASE, а не голое сравнение: у заказа без клиента user_id = X даёт NULL, а нужен false
+        mine = Q(user_id=request.user.id)
         try:
             order = (
-                Order.objects
-                .prefetch_related(Prefetch("events", queryset=TrackingEvent.objects.order_by("timestamp")))
+                _orders_for_serializer(Order.objects.all())
+                .annotate(
+                    is_owner=Case(When(mine, then=Value(True)), default=Value(False), output_field=BooleanField()),
+                    can_claim=Case(
+                        When(Q(user__isnull=True) | mine, then=Value(True)),
+                        default=Value(False),
+                        output_field=BooleanField(),
+                    ),
+                )
                 .get(tracking_number=tn)
             )
         except Order.DoesNotExist:
             return Response({"detail": "Трек не найден."}, status=status.HTTP_404_NOT_FOUND)
 
-        is_owner = (order.user_id == request.user.id)
-        can_claim = (order.user_id is None) or is_owner
-
-        data = OrderSerializer(order).data
-        data.update({"is_owner": is_owner, "can_claim": can_claim})
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(OrderFindSerializer(order).data, status=status.HTTP_200_OK)
 
 
 # =========================
@@ -261,24 +387,19 @@ class OrderClaimAPIView(APIView):
         if not tn:
             return Response({"detail": "Укажите tracking_number."}, status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            try:
-                order = Order.objects.select_for_update().get(tracking_number=tn)
-            except Order.DoesNotExist:
-                return Response({"detail": "Трек не найден."}, status=status.HTTP_404_NOT_FOUND)
-
-            # если уже ваш — просто возвращаем
-            if order.user_id == request.user.id:
-                return Response(OrderSerializer(order).data, status=status.HTTP_200_OK)
+        # привязка свободного заказа — один условный UPDATE, без SELECT FOR UPDATE и транзакции
+        Order.objects.filter(tracking_number=tn, user__isnull=True).update(user=request.user)
 
-            # если свободен — привязываем
-            if order.user_id is None:
-                order.user = request.user
-                order.save(update_fields=["user"])
-                return Response(OrderSerializer(order).data, status=status.HTTP_200_OK)
+        try:
+            order = _orders_for_serializer(Order.objects.filter(tracking_number=tn)).get()
+        except Order.DoesNotExist:
+            return Response({"detail": "Трек не найден."}, status=status.HTTP_404_NOT_FOUND)
 
-            # уже принадлежит кому-то другому
+        # уже принадлежит кому-то другому (если уже ваш — просто возвращаем)
+        if order.user_id != request.user.id:
             return Response(
                 {"detail": "Этот трек уже закреплён за другим пользователем."},
                 status=status.HTTP_409_CONFLICT,
             )
+
+        return Response(OrderSerializer(order).data, status=status.HTTP_200_OK)
@@ -0,0 +1,76 @@
+# core/doc_urls.py — документация API, подключается под /docs/
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import Http404
+from django.urls import path
+
+from rest_framework import permissions
+
+# схема собирается интроспекцией всех вьюх/сериалайзеров — кэшируем готовую на час
+SCHEMA_CACHE_TIMEOUT = 60 * 60
+SCHEMA_CACHE_KWARGS = {'key_prefix': 'lidercargo-schema-v1'}
+
+
+@lru_cache(maxsize=1)
+def _schema_view():
+    # drf_yasg грузим при первом заходе в документацию, а не при старте каждого воркера
+    from drf_yasg import openapi
+    from drf_yasg.views import get_schema_view
+
+    return get_schema_view(
+        openapi.Info(
+            title="LiderCargo API",
+            default_version='v1',
+            description="API для проекта LiderCargo",
+            terms_of_service="#",
+            contact=openapi.Contact(email="support@NurCRM.com"),
+            license=openapi.License(name="LiderCargo License"),
+        ),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+
+
+@lru_cache(maxsize=None)
+def _docs_view(renderer=None):
+    """Готовая (закэшированная) вьюха: renderer=None — только JSON, иначе 'swagger' / 'redoc'."""
+    schema_view = _schema_view()
+    if renderer is None:
+        return schema_view.without_ui(cache_timeout=SCHEMA_CACHE_TIMEOUT, cache_kwargs=SCHEMA_CACHE_KWARGS)
+    return schema_view.with_ui(renderer, cache_timeout=SCHEMA_CACHE_TIMEOUT, cache_kwargs=SCHEMA_CACHE_KWARGS)
+
+
+def _staff_only(view):
+    """Документация — только сотрудникам с сессией админки; без админки войти негде, отдаём 404."""
+    if settings.ADMIN_ENABLED:
+        from django.contrib.admin.views.decorators import staff_member_required
+
+        return staff_member_required(view)
+
+    def not_found(request, *args, **kwargs):
+        raise Http404
+
+    return not_found
+
+
+@_staff_only
+def schema_json(request, *args, **kwargs):
+    return _docs_view()(request, *args, **kwargs)
+
+
+@_staff_only
+def swagger_ui(request, *args, **kwargs):
+    return _docs_view('swagger')(request, *args, **kwargs)
+
+
+@_staff_only
+def redoc_ui(request, *args, **kwargs):
+    return _docs_view('redoc')(request, *args, **kwargs)
+
+
+urlpatterns = [
+    path('swagger.json', schema_json, name='schema-json'),
+    path('swagger/', swagger_ui, name='schema-swagger-ui'),
+    path('redoc/', redoc_ui, name='schema-redoc'),
+]
@@ -0,0 +1,38 @@
+# core/middleware.py
+from django.conf import settings
+
+from apps.users.views import index
+
+# свои префиксы — сюда 404 отдаём как есть; кортеж собираем один раз при импорте
+SPA_SKIP_PREFIXES = tuple(dict.fromkeys(
+    prefix
+    for prefix in (
+        "/v1/",
+        "/admin/",
+        "/docs/",
+        "/silk/" if getattr(settings, "ENABLE_SILK", False) else "",  # профайлер смонтирован только при DJANGO_ENABLE_SILK=1
+        settings.STATIC_URL,
+        settings.MEDIA_URL,
+    )
+    if prefix and prefix.startswith("/")  # STATIC_URL на CDN — не наш путь
+))
+
+
+class SPAFallbackMiddleware:
+    """
+    SPA: всё, что не нашлось в urlpatterns и не относится к API/админке/статике,
+    отдаём index.html. Срабатывает только на 404 — обычные маршруты не трогает.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.status_code == 404
+            and request.method in ("GET", "HEAD")
+            and not request.path.startswith(SPA_SKIP_PREFIXES)
+        ):
+            return index(request)
+        return response
@@ -18,6 +18,8 @@ import os
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SCAN_COOLDOWN_MINUTES = 0
+# как долго воркер держит шаблоны автостатусов в памяти, сек
+AUTO_STATUS_TEMPLATES_TTL = 60
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -30,6 +32,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = ["*"]
 
+# Админка (jazzmin + django.contrib.admin). На воркерах только под API можно выключить: ADMIN_ENABLED=0
+ADMIN_ENABLED = os.environ.get("ADMIN_ENABLED", "1") != "0"
+
 
 # Application definition
 
@@ -60,9 +65,12 @@ INSTALLED_APPS = [
     # 'apps.storehouse',
     # "apps.instagram_mcp",
 ]
+if not ADMIN_ENABLED:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ("jazzmin", "django.contrib.admin")]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',  # /static/ отдаёт WhiteNoise (gzip/brotli, кэш-заголовки)
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,8 +78,23 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.SPAFallbackMiddleware',  # последним: 404 вне API -> index.html
 ]
 
+# Профилирование запросов через django-silk — только для разработки.
+# Включается переменной окружения DJANGO_ENABLE_SILK=1 (pip install django-silk).
+ENABLE_SILK = DEBUG and os.environ.get("DJANGO_ENABLE_SILK") == "1"
+if ENABLE_SILK:
+    INSTALLED_APPS += ["silk"]
+    MIDDLEWARE.insert(0, "silk.middleware.SilkyMiddleware")
+    SILKY_PYTHON_PROFILER = True
+    SILKY_AUTHENTICATION = True
+    SILKY_AUTHORISATION = True
+    SILKY_PERMISSIONS = lambda user: user.is_superuser
+    # вместо периодической очистки (manage.py silk_clear_request_log) держим только свежие запросы
+    SILKY_MAX_RECORDED_REQUESTS = 10_000
+    SILKY_MAX_RECORDED_REQUESTS_CHECK_PERCENT = 10
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -159,6 +182,12 @@ STATICFILES_DIRS = [
     # BASE_DIR / 'static',  # опционально, если есть своя статика
 ]
 
+# collectstatic заранее жмёт файлы в .gz/.br — WhiteNoise отдаёт готовые
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedStaticFilesStorage"},
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
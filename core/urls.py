@@ -1,55 +1,43 @@
-from django.contrib import admin
-from django.urls import path, include, re_path
+from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-
 from apps.users.views import index  # index должен отдавать React index.html
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="LiderCargo API",
-        default_version='v1',
-        description="API для проекта LiderCargo",
-        terms_of_service="#",
-        contact=openapi.Contact(email="support@NurCRM.com"),
-        license=openapi.License(name="LiderCargo License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
-
 # ---- API только тут ----
 api_urlpatterns = [
     path('api/users/', include('apps.users.urls')),
     # Добавляй другие api/* сюда
 ]
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
-
+_patterns = [
     # Вся API под /v1/...
     path('v1/', include(api_urlpatterns)),
 
-    # Документация
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    # Документация: /docs/swagger/, /docs/redoc/
+    path('docs/', include('core.doc_urls')),
+]
+
+# Админка — если не выключена (ADMIN_ENABLED=0 для воркеров только под API)
+if settings.ADMIN_ENABLED:
+    from django.contrib import admin
 
+    _patterns.insert(0, path('admin/', admin.site.urls))
+
+# Профайлер запросов (DJANGO_ENABLE_SILK=1, только DEBUG)
+if getattr(settings, "ENABLE_SILK", False):
+    _patterns += [path('silk/', include('silk.urls', namespace='silk'))]
+
+_patterns += [
     # Главная SPA страница
+    # остальные пути SPA отдаёт core.middleware.SPAFallbackMiddleware (на 404)
     path('', index, name='index'),
-
-    # Catch-all для SPA: всё, что НЕ начинается с перечисленных префиксов, отдаём index
-    re_path(r'^(?!v1/|admin/|swagger/|redoc/|static/|media/).*$',
-            index, name='spa-catchall'),
 ]
 
-# ---- Медиа/статика в DEV ----
-# Для MEDIA нужно явно добавлять всегда в dev:
+# ---- Медиа в DEV ----
+# Для MEDIA нужно явно добавлять всегда в dev (статику отдаёт WhiteNoise):
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    # Для статики в dev обычно не нужно, если стоит django.contrib.staticfiles.
-    # Но если хочешь раздавать из STATIC_ROOT (после collectstatic), можно так:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    _patterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+# собрали один раз — дальше неизменяемый кортеж
+urlpatterns = tuple(_patterns)
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# URLconf и reverse-словари резолвер строит лениво на первом запросе — собираем при старте воркера
+# (с gunicorn --preload — один раз в мастере, воркеры получают готовое через fork)
+from django.urls import get_resolver  # noqa: E402
+
+get_resolver().reverse_dict